@@ -5,8 +5,9 @@ __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
 # Public API
-from . import _model as model, _field as field
+from . import _model as model, _field as field, _error as error, _upload as upload
 from ._driver import Driver
+from ._resize_worker import ResizeWorker
 
 
 def plugin_load():
@@ -21,4 +22,24 @@ def plugin_load():
     router.handle(_controllers.Image, '/image/resize/<int:width>/<int:height>/<p1>/<p2>/<filename>',
                   'file_storage_odm@image', defaults={'width': 0, 'height': 0})
 
+    # Resumable uploads
+    router.handle(_controllers.UploadCreate, '/file_storage_odm/upload', 'file_storage_odm@upload_create',
+                  methods='POST')
+    router.handle(_controllers.UploadStatus, '/file_storage_odm/upload/<uid>', 'file_storage_odm@upload',
+                  methods='HEAD')
+    router.handle(_controllers.UploadWrite, '/file_storage_odm/upload/<uid>', 'file_storage_odm@upload_write',
+                  methods='PATCH')
+    router.handle(_controllers.UploadAbort, '/file_storage_odm/upload/<uid>', 'file_storage_odm@upload_abort',
+                  methods='DELETE')
+    router.handle(_controllers.UploadFinalize, '/file_storage_odm/upload/<uid>/finalize',
+                  'file_storage_odm@upload_finalize', methods='POST')
+
     cleanup.on_cleanup(_eh.pytsite_cleanup)
+
+
+def plugin_load_console():
+    from pytsite import console
+    from . import _console_command
+
+    console.register_command(_console_command.ResizeWorker())
+    console.register_command(_console_command.Check())
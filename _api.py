@@ -4,23 +4,34 @@ __author__ = 'Oleksandr Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
+import hashlib as _hashlib
+from functools import lru_cache as _lru_cache
 from pytsite import reg as _reg
 
-_resize_limit_width = int(_reg.get('file_storage_odm.image_resize_limit_width', 1200))
-_resize_limit_height = int(_reg.get('file_storage_odm.image_resize_limit_height', 1200))
-_resize_step = int(_reg.get('file_storage_odm.image_resize_step', 50))
-
 
+@_lru_cache()
 def get_image_resize_limit_width() -> int:
-    return _resize_limit_width
+    return int(_reg.get('file_storage_odm.image_resize_limit_width', 1200))
 
 
+@_lru_cache()
 def get_image_resize_limit_height() -> int:
-    return _resize_limit_height
+    return int(_reg.get('file_storage_odm.image_resize_limit_height', 1200))
 
 
+@_lru_cache()
 def get_image_resize_step() -> int:
-    return _resize_step
+    return int(_reg.get('file_storage_odm.image_resize_step', 50))
+
+
+@_lru_cache()
+def get_upload_max_length() -> int:
+    return int(_reg.get('file_storage_odm.upload_max_length', 1073741824))
+
+
+@_lru_cache()
+def get_upload_max_sessions() -> int:
+    return int(_reg.get('file_storage_odm.upload_max_sessions', 10))
 
 
 def align_image_side(length: int, max_length: int, step: int = None) -> int:
@@ -41,3 +52,15 @@ def align_image_side(length: int, max_length: int, step: int = None) -> int:
             return n
 
     return max_length
+
+
+def hash_file(file_path: str, chunk_size: int = 1048576) -> str:
+    """Calculate SHA-256 hash of a file
+    """
+    h = _hashlib.sha256()
+
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
@@ -0,0 +1,89 @@
+"""PytSite ODM File Storage Console Commands
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from socketserver import ThreadingMixIn as _ThreadingMixIn
+from wsgiref.simple_server import make_server as _make_server, WSGIServer as _WSGIServer
+from pytsite import console as _console
+from . import _resize_worker, _scanner
+
+
+class _ThreadingWSGIServer(_ThreadingMixIn, _WSGIServer):
+    daemon_threads = True
+
+
+class ResizeWorker(_console.Command):
+    """Run standalone image resize worker
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.define_option(_console.option.Str('host', default='127.0.0.1'))
+        self.define_option(_console.option.Int('port', default=8081))
+        self.define_option(_console.option.Int('workers', default=0))
+
+    @property
+    def name(self) -> str:
+        return 'file_storage_odm:resize_worker'
+
+    @property
+    def description(self) -> str:
+        return 'file_storage_odm@resize_worker_console_command_description'
+
+    def exec(self):
+        host, port = self.opt('host'), self.opt('port')
+        worker = _resize_worker.ResizeWorker(self.opt('workers') or None)
+        server = _make_server(host, port, worker, _ThreadingWSGIServer)
+
+        _console.print_info('Image resize worker is listening on {}:{}'.format(host, port))
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            worker.shutdown()
+
+
+class Check(_console.Command):
+    """Check integrity of stored files
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.define_option(_console.option.Bool('fix'))
+        self.define_option(_console.option.Bool('hash'))
+        self.define_option(_console.option.Int('threads', default=8))
+        self.define_option(_console.option.Int('batch', default=1000))
+
+    @property
+    def name(self) -> str:
+        return 'file_storage_odm:check'
+
+    @property
+    def description(self) -> str:
+        return 'file_storage_odm@check_console_command_description'
+
+    def exec(self):
+        r = _scanner.scan(self.opt('fix'), self.opt('hash'), self.opt('threads'), self.opt('batch'))
+
+        for uid in r.ghosts:
+            _console.print_warning('File is missing: {}'.format(uid))
+
+        for f_path in r.orphans:
+            _console.print_warning('File has no entity: {}'.format(f_path))
+
+        for uid, field, stored, actual in r.mismatches:
+            _console.print_warning("Field '{}' mismatch for {}: stored {}, actual {}".format(field, uid, stored, actual))
+
+        for uid, error in r.errors:
+            _console.print_error('Error while checking {}: {}'.format(uid, error))
+
+        _console.print_info('Files checked: {}, missing: {}, without entity: {}, mismatches: {}, fixed: {}, '
+                            'errors: {}'.format(r.checked, len(r.ghosts), len(r.orphans), len(r.mismatches), r.fixed,
+                                                len(r.errors)))
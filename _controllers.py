@@ -4,12 +4,10 @@ __author__ = 'Oleksandr Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
-from os import path as _path, makedirs as _makedirs
-from math import floor as _floor
-from PIL import Image as _Image
-from pytsite import reg as _reg, router as _router, routing as _routing
-from plugins import file as _file
-from . import _model, _api
+from os import path as _path
+from pytsite import reg as _reg, router as _router, routing as _routing, http as _http
+from plugins import file as _file, auth as _auth
+from . import _model, _api, _image, _upload, _error
 
 
 class Image(_routing.Controller):
@@ -43,73 +41,137 @@ class Image(_routing.Controller):
             })
             return self.redirect(redirect, 301)
 
-        # Original size
-        orig_width = img_file.width
-        orig_height = img_file.height
-        orig_ratio = orig_width / orig_height
-
-        need_resize = True
-
-        # Calculate new size
-        if not requested_width and not requested_height:
-            # No resize needed, return original image
-            resize_width = orig_width
-            resize_height = orig_height
-            need_resize = False
-        elif requested_width and not requested_height:
-            # Resize by width, preserve aspect ration
-            resize_width = requested_width
-            resize_height = _floor(requested_width / orig_ratio)
-        elif requested_height and not requested_width:
-            # Resize by height, preserve aspect ration
-            resize_width = _floor(requested_height * orig_ratio)
-            resize_height = requested_height
-        else:
-            # Exact resizing
-            resize_width = requested_width
-            resize_height = requested_height
-
         # Checking source file
         storage_path = img_file.get_field('storage_path')
         if not _path.exists(storage_path):
             return self.redirect('http://placehold.it/{}x{}'.format(requested_width, requested_height))
 
         # Calculating target file location
-        static_path = _path.join(_reg.get('paths.static'), 'image', 'resize', str(requested_width),
-                                 str(requested_height), p1, p2, filename)
-
-        # Create target directory
-        target_dir = _path.dirname(static_path)
-        if not _path.exists(target_dir):
-            _makedirs(target_dir, 0o755, True)
+        static_path = _image.get_static_path(_reg.get('paths.static'), requested_width, requested_height, p1, p2,
+                                             filename)
 
         if not _path.exists(static_path):
-            # Open source image
-            img = _Image.open(storage_path)  # type: _Image
-
-            # Resize
-            if need_resize:
-                # Crop
-                crop_ratio = resize_width / resize_height
-                crop_width = orig_width
-                crop_height = _floor(crop_width / crop_ratio)
-                crop_top = _floor(orig_height / 2) - _floor(crop_height / 2)
-                crop_left = 0
-                if crop_height > orig_height:
-                    crop_height = orig_height
-                    crop_width = _floor(crop_height * crop_ratio)
-                    crop_top = 0
-                    crop_left = _floor(orig_width / 2) - _floor(crop_width / 2)
-                crop_right = crop_left + crop_width
-                crop_bottom = crop_top + crop_height
-
-                cropped = img.crop((crop_left, crop_top, crop_right, crop_bottom))
-                img.close()
-
-                # Resize
-                img = cropped.resize((resize_width, resize_height), _Image.BILINEAR)
-
-            img.save(static_path)
-            img.close()
+            _image.resize(storage_path, static_path, requested_width, requested_height)
 
         return self.redirect(img_file.get_url(width=requested_width, height=requested_height))
+
+
+class _Upload(_routing.Controller):
+    """Base upload controller
+    """
+
+    def _get_upload(self) -> _upload.Upload:
+        try:
+            upload = _upload.get(self.arg('uid'))
+        except _error.UploadNotFound as e:
+            raise self.not_found(str(e))
+
+        if upload.owner != _auth.get_current_user().uid:
+            raise self.forbidden()
+
+        return upload
+
+    @staticmethod
+    def _offset_response(upload: _upload.Upload, offset: int, status: int = 204) -> _http.Response:
+        r = _http.Response(status=status)
+        r.headers['Upload-Offset'] = str(offset)
+        r.headers['Upload-Length'] = str(upload.length)
+        r.headers['Cache-Control'] = 'no-store'
+
+        return r
+
+
+class UploadCreate(_Upload):
+    """Create upload session
+    """
+
+    def exec(self):
+        user = _auth.get_current_user()
+        if user.is_anonymous:
+            raise self.forbidden()
+
+        if not self.arg('name') or not self.arg('mime'):
+            return _http.Response('Name and MIME type are required', status=400)
+
+        try:
+            length = int(self.arg('length', self.request.headers.get('Upload-Length')))
+            upload = _upload.create(self.arg('name'), self.arg('mime'), length, self.arg('description'), user.uid)
+        except (TypeError, ValueError) as e:
+            return _http.Response(str(e), status=400)
+        except _error.UploadLengthExceeded as e:
+            return _http.Response(str(e), status=413)
+        except _error.UploadLimitExceeded as e:
+            return _http.Response(str(e), status=429)
+
+        r = _http.JSONResponse(upload.as_jsonable(), status=201)
+        r.headers['Location'] = _router.rule_url('file_storage_odm@upload', {'uid': upload.uid})
+
+        return r
+
+
+class UploadStatus(_Upload):
+    """Get upload offset
+    """
+
+    def exec(self):
+        upload = self._get_upload()
+
+        return self._offset_response(upload, upload.offset, 200)
+
+
+class UploadWrite(_Upload):
+    """Write upload chunk
+    """
+
+    def exec(self):
+        upload = self._get_upload()
+
+        try:
+            offset = int(self.request.headers.get('Upload-Offset'))
+        except (TypeError, ValueError):
+            return _http.Response('Upload-Offset header is required', status=400)
+
+        try:
+            offset = _upload.write(upload.uid, offset, self.request.stream)
+        except _error.UploadNotFound as e:
+            raise self.not_found(str(e))
+        except (_error.UploadOffsetMismatch, _error.UploadLocked, _error.UploadFinalized) as e:
+            return _http.Response(str(e), status=409)
+        except _error.UploadLengthExceeded as e:
+            return _http.Response(str(e), status=413)
+
+        return self._offset_response(upload, offset)
+
+
+class UploadFinalize(_Upload):
+    """Finalize upload
+    """
+
+    def exec(self):
+        upload = self._get_upload()
+
+        try:
+            file = _upload.finalize(upload.uid)
+        except _error.UploadNotFound as e:
+            raise self.not_found(str(e))
+        except _error.UploadLocked as e:
+            return _http.Response(str(e), status=409)
+        except _error.UploadIncomplete as e:
+            return _http.Response(str(e), status=400)
+        except _error.UploadInvalidFile as e:
+            return _http.Response(str(e), status=415)
+
+        return _http.JSONResponse(file.as_jsonable(), status=201)
+
+
+class UploadAbort(_Upload):
+    """Abort upload
+    """
+
+    def exec(self):
+        try:
+            _upload.abort(self._get_upload().uid)
+        except _error.UploadNotFound as e:
+            raise self.not_found(str(e))
+
+        return _http.Response(status=204)
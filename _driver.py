@@ -44,6 +44,45 @@ def _build_store_path(name: str, mime: str, propose: str = None) -> str:
     return store_path
 
 
+def _dispense_entity(abs_path: str, mime: str, name: str, description: str = None,
+                     file_hash: str = None) -> _model.AnyFileODMEntity:
+    """Dispense ODM entity for a file which is already located in the storage
+    """
+    if _IMG_MIME_RE.search(mime):
+        odm_entity = _odm.dispense('file_image')  # type: _model.ImageFileODMEntity
+    else:
+        odm_entity = _odm.dispense('file')  # type: _model.AnyFileODMEntity
+
+    storage_dir = _reg.get('paths.storage')
+    odm_entity.f_set('path', abs_path.replace(storage_dir + '/', ''))
+    odm_entity.f_set('name', name)
+    odm_entity.f_set('description', description)
+    odm_entity.f_set('mime', mime)
+    odm_entity.f_set('length', _os.path.getsize(abs_path))
+    odm_entity.f_set('hash', file_hash)
+
+    return odm_entity
+
+
+def _wrap_entity(odm_entity: _model.AnyFileODMEntity) -> _file.model.AbstractFile:
+    """Get file model for an ODM entity
+    """
+    if isinstance(odm_entity, _model.ImageFileODMEntity):
+        return _model.ImageFile(odm_entity)
+    elif isinstance(odm_entity, _model.AnyFileODMEntity):
+        return _model.AnyFile(odm_entity)
+
+
+def _create_file(abs_path: str, mime: str, name: str, description: str = None,
+                 file_hash: str = None) -> _file.model.AbstractFile:
+    """Create ODM entity for a file which is already located in the storage
+    """
+    odm_entity = _dispense_entity(abs_path, mime, name, description, file_hash)
+    odm_entity.save()
+
+    return _wrap_entity(odm_entity)
+
+
 class Driver(_file.driver.Abstract):
     def create(self, file_path: str, mime: str, name: str = None, description: str = None, propose_path: str = None,
                **kwargs) -> _file.model.AbstractFile:
@@ -63,24 +102,7 @@ class Driver(_file.driver.Abstract):
         # Copy file to the storage
         _shutil.copy(file_path, abs_target_path)
 
-        # Create ODM entity
-        if _IMG_MIME_RE.search(mime):
-            odm_entity = _odm.dispense('file_image')  # type: _model.ImageFileODMEntity
-        else:
-            odm_entity = _odm.dispense('file')  # type: _model.AnyFileODMEntity
-
-        storage_dir = _reg.get('paths.storage')
-        odm_entity.f_set('path', abs_target_path.replace(storage_dir + '/', ''))
-        odm_entity.f_set('name', name)
-        odm_entity.f_set('description', description)
-        odm_entity.f_set('mime', mime)
-        odm_entity.f_set('length', _os.path.getsize(file_path))
-        odm_entity.save()
-
-        if isinstance(odm_entity, _model.ImageFileODMEntity):
-            return _model.ImageFile(odm_entity)
-        elif isinstance(odm_entity, _model.AnyFileODMEntity):
-            return _model.AnyFile(odm_entity)
+        return _create_file(abs_target_path, mime, name, description)
 
     def get(self, uid: str) -> _file.model.AbstractFile:
         """Get file by UID
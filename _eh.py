@@ -6,6 +6,7 @@ __license__ = 'MIT'
 
 from os import path as _path
 from pytsite import util as _util, reg as _reg, logger as _logger
+from . import _upload
 
 
 def pytsite_cleanup():
@@ -19,3 +20,6 @@ def pytsite_cleanup():
 
     for f_path, e in failed:
         _logger.error('Error while removing obsolete static file {}: {}'.format(f_path, e))
+
+    for uid in _upload.cleanup(_reg.get('file_storage_odm.upload_ttl', 86400)):  # 1 day
+        _logger.debug('Obsolete upload removed: {}'.format(uid))
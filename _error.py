@@ -0,0 +1,41 @@
+"""PytSite ODM File Storage Errors
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+
+class Error(Exception):
+    pass
+
+
+class UploadNotFound(Error):
+    pass
+
+
+class UploadOffsetMismatch(Error):
+    pass
+
+
+class UploadLocked(Error):
+    pass
+
+
+class UploadLengthExceeded(Error):
+    pass
+
+
+class UploadIncomplete(Error):
+    pass
+
+
+class UploadFinalized(Error):
+    pass
+
+
+class UploadInvalidFile(Error):
+    pass
+
+
+class UploadLimitExceeded(Error):
+    pass
@@ -0,0 +1,91 @@
+"""PytSite ODM File Storage Image Processing Functions
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from os import path as _path, makedirs as _makedirs, replace as _replace, unlink as _unlink, close as _close, \
+    chmod as _chmod
+from math import floor as _floor
+from tempfile import mkstemp as _mkstemp
+from typing import Tuple as _Tuple
+
+
+def get_static_path(static_root: str, width: int, height: int, p1: str, p2: str, filename: str) -> str:
+    """Get path of the resized image within the static files directory
+    """
+    return _path.join(static_root, 'image', 'resize', str(width), str(height), p1, p2, filename)
+
+
+def get_resize_size(orig_width: int, orig_height: int, width: int, height: int) -> _Tuple[int, int]:
+    """Calculate target size of an image
+    """
+    orig_ratio = orig_width / orig_height
+
+    if not width and not height:
+        # No resize needed, original size
+        return orig_width, orig_height
+    elif width and not height:
+        # Resize by width, preserve aspect ration
+        return width, _floor(width / orig_ratio)
+    elif height and not width:
+        # Resize by height, preserve aspect ration
+        return _floor(height * orig_ratio), height
+    else:
+        # Exact resizing
+        return width, height
+
+
+def resize(source_path: str, target_path: str, width: int, height: int):
+    """Crop and resize an image and store result to the target path
+
+    This function depends only on the filesystem, so it is safe to run it in a separate process.
+    """
+    from PIL import Image as _Image
+
+    # Create target directory
+    target_dir = _path.dirname(target_path)
+    if not _path.exists(target_dir):
+        _makedirs(target_dir, 0o755, True)
+
+    # Open source image
+    img = _Image.open(source_path)  # type: _Image.Image
+    orig_width, orig_height = img.size
+    resize_width, resize_height = get_resize_size(orig_width, orig_height, width, height)
+
+    # Resize
+    if width or height:
+        # Crop
+        crop_ratio = resize_width / resize_height
+        crop_width = orig_width
+        crop_height = _floor(crop_width / crop_ratio)
+        crop_top = _floor(orig_height / 2) - _floor(crop_height / 2)
+        crop_left = 0
+        if crop_height > orig_height:
+            crop_height = orig_height
+            crop_width = _floor(crop_height * crop_ratio)
+            crop_top = 0
+            crop_left = _floor(orig_width / 2) - _floor(crop_width / 2)
+        crop_right = crop_left + crop_width
+        crop_bottom = crop_top + crop_height
+
+        cropped = img.crop((crop_left, crop_top, crop_right, crop_bottom))
+        img.close()
+
+        # Resize
+        img = cropped.resize((resize_width, resize_height), _Image.BILINEAR)
+
+    # Static directory may be shared between several processes and nodes, so write to a temporary file first and
+    # then atomically move it, to never expose partially written images
+    fd, tmp_path = _mkstemp(_path.splitext(target_path)[1], '.', target_dir)
+    _close(fd)
+    try:
+        img.save(tmp_path)
+        _chmod(tmp_path, 0o644)
+        _replace(tmp_path, target_path)
+    except Exception:
+        if _path.exists(tmp_path):
+            _unlink(tmp_path)
+        raise
+    finally:
+        img.close()
@@ -4,10 +4,8 @@ __author__ = 'Oleksandr Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
-import exifread as _exifread
 import re as _re
 from os import unlink as _unlink, path as _path
-from PIL import Image as _PILImage
 from pytsite import reg as _reg, router as _router
 from plugins import odm as _odm, file as _file
 from . import _api
@@ -27,10 +25,31 @@ class AnyFileODMEntity(_odm.model.Entity):
         self.define_field(_odm.field.String('description'))
         self.define_field(_odm.field.String('mime', is_required=True))
         self.define_field(_odm.field.Integer('length', is_required=True))
+        self.define_field(_odm.field.String('hash'))
         self.define_field(_odm.field.Virtual('storage_path'))
         self.define_field(_odm.field.Virtual('url'))
         self.define_field(_odm.field.Virtual('thumb_url'))
 
+    def _on_pre_save(self, **kwargs):
+        """Hook.
+        """
+        super()._on_pre_save(**kwargs)
+
+        is_modified = self._process_file()
+
+        # Hash is calculated only once, after the file has been processed
+        if is_modified:
+            self.f_set('length', _path.getsize(self.f_get('storage_path')))
+        if is_modified or (self.is_new and not self.f_get('hash')):
+            self.f_set('hash', _api.hash_file(self.f_get('storage_path')))
+
+    def _process_file(self) -> bool:
+        """Process stored file before saving the entity.
+
+        Returns True if the file's content has been changed.
+        """
+        return False
+
     def _on_after_delete(self, **kwargs):
         """_after_delete() hook.
         """
@@ -80,10 +99,12 @@ class ImageFileODMEntity(AnyFileODMEntity):
         self.define_field(_odm.field.Integer('height'))
         self.define_field(_odm.field.Dict('exif'))
 
-    def _on_pre_save(self, **kwargs):
+    def _process_file(self) -> bool:
         """Hook.
         """
-        super()._on_pre_save(**kwargs)
+        # Heavy dependencies are imported here to not slow down processes which don't deal with images
+        import exifread as _exifread
+        from PIL import Image as _PILImage
 
         # Read EXIF from file
         with open(self.f_get('storage_path'), 'rb') as f:
@@ -96,6 +117,7 @@ class ImageFileODMEntity(AnyFileODMEntity):
 
         # Open image for processing
         image = _PILImage.open(self.f_get('storage_path'))  # type: _PILImage.Image
+        is_modified = False
 
         # Rotate image
         if 'Image Orientation' in exif:
@@ -111,6 +133,7 @@ class ImageFileODMEntity(AnyFileODMEntity):
             if rotated:
                 rotated.save(self.f_get('storage_path'))
                 image = rotated
+                is_modified = True
 
         # Convert BMP and JPEG2000 to JPEG
         if image.format in ('BMP', 'JPEG2000'):
@@ -125,12 +148,15 @@ class ImageFileODMEntity(AnyFileODMEntity):
 
             image.save(self.f_get('storage_path'))
             _unlink(current_storage_path)
+            is_modified = True
 
         self.f_set('width', image.size[0])
         self.f_set('height', image.size[1])
 
         image.close()
 
+        return is_modified
+
     def _on_f_get(self, field_name: str, value, **kwargs):
         """Hook.
         """
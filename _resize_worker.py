@@ -0,0 +1,172 @@
+"""PytSite ODM File Storage Image Resize Worker
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import re as _re
+from os import path as _path, fstat as _fstat
+from mimetypes import guess_type as _guess_type
+from threading import Lock as _Lock
+from concurrent.futures import Executor as _Executor, Future as _Future
+from typing import Dict as _Dict, Optional as _Optional, Tuple as _Tuple, List as _List
+from pytsite import reg as _reg, logger as _logger
+from plugins import file as _file
+from . import _api, _image
+
+_PATH_RE = _re.compile(r'^/image/resize/(\d+)/(\d+)/(\w+)/(\w+)/([\w\-]+\.\w+)$')
+
+
+def _read_chunks(f, chunk_size: int = 65536):
+    with f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+class ResizeWorker:
+    """WSGI application which serves '/image/resize/...' requests, performing image processing in a process pool
+
+    Resized images are stored in the same static directory as the main application uses, so several worker instances,
+    deployed on separate nodes, share the cache if the static and storage directories are shared between them.
+    """
+
+    def __init__(self, max_workers: int = None, static_root: str = None, executor: _Executor = None):
+        """Init
+        """
+        self._static_root = static_root or _reg.get('paths.static')
+        self._max_workers = max_workers
+        self._executor = executor
+        self._executor_lock = _Lock()
+        self._pending = {}  # type: _Dict[str, _Future]
+        self._pending_lock = _Lock()
+
+    def shutdown(self, wait: bool = True):
+        """Shutdown the process pool
+        """
+        if self._executor:
+            self._executor.shutdown(wait)
+
+    def _get_executor(self) -> _Executor:
+        """Get executor, creating the process pool on first use
+        """
+        with self._executor_lock:
+            if not self._executor:
+                from concurrent.futures import ProcessPoolExecutor
+                self._executor = ProcessPoolExecutor(self._max_workers)
+
+            return self._executor
+
+    def _reset_executor(self, executor: _Executor):
+        """Drop broken process pool, so the next call creates a new one
+        """
+        with self._executor_lock:
+            if self._executor is executor:
+                self._executor = None
+
+        executor.shutdown(False)
+
+    def _resize(self, source_path: str, target_path: str, width: int, height: int):
+        """Resize an image in the process pool, sharing the job between concurrent requests for the same target
+        """
+        from concurrent.futures.process import BrokenProcessPool
+
+        # Pool becomes broken forever if one of its processes dies, so it is recreated and the job is retried once
+        for attempt in range(2):
+            executor = self._get_executor()
+
+            try:
+                with self._pending_lock:
+                    future = self._pending.get(target_path)
+                    if not future:
+                        future = executor.submit(_image.resize, source_path, target_path, width, height)
+                        self._pending[target_path] = future
+
+                try:
+                    return future.result()
+                finally:
+                    with self._pending_lock:
+                        if self._pending.get(target_path) is future:
+                            del self._pending[target_path]
+
+            except BrokenProcessPool:
+                self._reset_executor(executor)
+                if attempt:
+                    raise
+                _logger.warn('Image resize process pool is broken, restarting it')
+
+    def __call__(self, environ: dict, start_response):
+        """Handle a request
+        """
+        if environ.get('REQUEST_METHOD') not in ('GET', 'HEAD'):
+            start_response('405 Method Not Allowed', [('Allow', 'GET, HEAD')])
+            return [b'']
+
+        m = _PATH_RE.match(environ.get('PATH_INFO', ''))
+        if not m:
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'Not found']
+
+        requested_width, requested_height = int(m.group(1)), int(m.group(2))
+        p1, p2, filename = m.group(3), m.group(4), m.group(5)
+
+        # Align side lengths and redirect
+        aligned_width = _api.align_image_side(requested_width, _api.get_image_resize_limit_width())
+        aligned_height = _api.align_image_side(requested_height, _api.get_image_resize_limit_height())
+        if aligned_width != requested_width or aligned_height != requested_height:
+            location = '/image/resize/{}/{}/{}/{}/{}'.format(aligned_width, aligned_height, p1, p2, filename)
+            start_response('301 Moved Permanently', [('Location', location)])
+            return [b'']
+
+        static_path = _image.get_static_path(self._static_root, requested_width, requested_height, p1, p2, filename)
+
+        # Cached image can be removed by cleanup at any moment, so it is regenerated once if it has disappeared
+        for _ in range(2):
+            if not _path.exists(static_path):
+                error = self._generate(static_path, requested_width, requested_height, filename)
+                if error:
+                    start_response(error[0], error[1])
+                    return [error[2]]
+
+            try:
+                f = open(static_path, 'rb')
+            except FileNotFoundError:
+                continue
+
+            headers = [
+                ('Content-Type', _guess_type(filename)[0] or 'application/octet-stream'),
+                ('Content-Length', str(_fstat(f.fileno()).st_size)),
+            ]
+            start_response('200 OK', headers)
+
+            if environ.get('REQUEST_METHOD') == 'HEAD':
+                f.close()
+                return [b'']
+
+            file_wrapper = environ.get('wsgi.file_wrapper')
+
+            return file_wrapper(f, 65536) if file_wrapper else _read_chunks(f)
+
+        start_response('404 Not Found', [('Content-Type', 'text/plain')])
+        return [b'Not found']
+
+    def _generate(self, static_path: str, width: int, height: int,
+                  filename: str) -> _Optional[_Tuple[str, _List[tuple], bytes]]:
+        """Generate resized image, returning error response status, headers and body in case of failure
+        """
+        try:
+            img_file = _file.get('file_image:' + _path.splitext(filename)[0])
+        except _file.error.FileNotFound:
+            return '404 Not Found', [('Content-Type', 'text/plain')], b'Not found'
+
+        storage_path = img_file.get_field('storage_path')
+        if not _path.exists(storage_path):
+            return '302 Found', [('Location', 'http://placehold.it/{}x{}'.format(width, height))], b''
+
+        try:
+            self._resize(storage_path, static_path, width, height)
+        except Exception as e:
+            _logger.error('Error while resizing image {}: {}'.format(storage_path, e))
+            return '500 Internal Server Error', [('Content-Type', 'text/plain')], b'Internal server error'
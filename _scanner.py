@@ -0,0 +1,145 @@
+"""PytSite ODM File Storage Integrity Scanner
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from os import path as _path, walk as _walk, stat as _stat
+from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
+from typing import List as _List, Tuple as _Tuple, Optional as _Optional
+from pymongo import UpdateOne as _UpdateOne
+from pytsite import reg as _reg, mongodb as _mongodb
+from plugins import odm as _odm
+from . import _model, _api, _upload
+
+
+class ScanResult:
+    """Integrity scan result
+    """
+
+    def __init__(self):
+        """Init
+        """
+        self.checked = 0
+        self.fixed = 0
+        self.ghosts = []  # type: _List[str]
+        self.orphans = []  # type: _List[str]
+        self.mismatches = []  # type: _List[_Tuple[str, str, object, object]]
+        self.errors = []  # type: _List[_Tuple[str, str]]
+
+
+def _check_blob(storage_root: str, doc: dict, is_image: bool, verify_hash: bool) -> _Optional[dict]:
+    """Get actual metadata of a stored file, or None if the file doesn't exist
+    """
+    file_path = _path.join(storage_root, doc['path'])
+
+    try:
+        r = {'length': _stat(file_path).st_size}
+    except FileNotFoundError:
+        return None
+
+    if is_image:
+        from PIL import Image as _PILImage
+
+        # Only image header is read here
+        with _PILImage.open(file_path) as img:
+            r['width'], r['height'] = img.size
+
+    if verify_hash:
+        r['hash'] = _api.hash_file(file_path)
+
+    return r
+
+
+def _scan_collection(result: ScanResult, storage_root: str, model: str, collection_name: str, is_image: bool,
+                     executor: _ThreadPoolExecutor, known_paths: set, fix: bool, verify_hash: bool, batch_size: int):
+    fields = ['path', 'length', 'hash'] + (['width', 'height'] if is_image else [])
+    collection = _mongodb.get_collection(collection_name)
+    cursor = collection.find({}, {f: True for f in fields}, no_cursor_timeout=True, batch_size=batch_size)
+
+    def check(doc: dict):
+        try:
+            return doc, _check_blob(storage_root, doc, is_image, verify_hash), None
+        except Exception as e:
+            return doc, None, e
+
+    try:
+        while True:
+            docs = []
+            for doc in cursor:
+                docs.append(doc)
+                if len(docs) >= batch_size:
+                    break
+
+            if not docs:
+                break
+
+            updates = []
+            for doc, actual, error in executor.map(check, docs):
+                uid = '{}:{}'.format(model, doc['_id'])
+                known_paths.add(doc.get('path'))
+                result.checked += 1
+
+                if error:
+                    result.errors.append((uid, str(error)))
+                    continue
+
+                if actual is None:
+                    result.ghosts.append(uid)
+                    continue
+
+                to_fix = {}
+                for k, v in actual.items():
+                    stored = doc.get(k)
+                    if stored == v:
+                        continue
+
+                    # Missing hash is not a mismatch, it can be just stored
+                    if k == 'hash' and not stored:
+                        to_fix[k] = v
+                        continue
+
+                    result.mismatches.append((uid, k, stored, v))
+                    to_fix[k] = v
+
+                # Hash mismatch means that the content has been changed or corrupted, so metadata must not be adjusted to
+                # it, otherwise the length check would not reveal the problem anymore
+                if doc.get('hash') and to_fix.get('hash'):
+                    to_fix = {}
+
+                if fix and to_fix:
+                    updates.append(_UpdateOne({'_id': doc['_id']}, {'$set': to_fix}))
+
+            if updates:
+                modified = collection.bulk_write(updates, ordered=False).modified_count
+                result.fixed += modified
+
+                # Documents were updated bypassing ODM, so cached entities must be dropped
+                if modified:
+                    _odm.clear_cache(model)
+    finally:
+        cursor.close()
+
+
+def scan(fix: bool = False, verify_hash: bool = False, threads: int = 8, batch_size: int = 1000) -> ScanResult:
+    """Check consistency between stored files and their ODM entities
+    """
+    result = ScanResult()
+    storage_root = _reg.get('paths.storage')
+    known_paths = set()
+
+    with _ThreadPoolExecutor(threads) as executor:
+        for model, entity_cls, is_image in (('file', _model.AnyFileODMEntity, False),
+                                            ('file_image', _model.ImageFileODMEntity, True)):
+            _scan_collection(result, storage_root, model, entity_cls._collection_name, is_image, executor,
+                             known_paths, fix, verify_hash, batch_size)
+
+    # Search for files which have no entities, skipping files which are being uploaded
+    known_paths.update(_upload.get_pending_paths())
+    for dir_path, dir_names, file_names in _walk(_path.join(storage_root, 'file')):
+        for file_name in file_names:
+            rel_path = _path.relpath(_path.join(dir_path, file_name), storage_root)
+            if rel_path not in known_paths:
+                result.orphans.append(rel_path)
+
+    return result
@@ -0,0 +1,529 @@
+"""PytSite ODM File Storage Resumable Uploads
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import os as _os
+import re as _re
+import json as _json
+import hashlib as _hashlib
+from collections import OrderedDict as _OrderedDict
+from contextlib import contextmanager as _contextmanager
+from fcntl import flock as _flock, LOCK_EX as _LOCK_EX, LOCK_NB as _LOCK_NB
+from tempfile import mkstemp as _mkstemp
+from time import time as _time
+from threading import Lock as _Lock
+from typing import Tuple as _Tuple, List as _List, Set as _Set, Optional as _Optional
+from pytsite import reg as _reg, util as _util
+from plugins import odm as _odm, file as _file
+from . import _driver, _error, _api
+
+_UID_RE = _re.compile(r'^\w{32}$')
+_MIME_RE = _re.compile(r'^[a-z0-9][a-z0-9!#$&^_.+\-]*/[a-z0-9][a-z0-9!#$&^_.+\-]*$', _re.IGNORECASE)
+
+# Incremental hashes of uploads recently written by this process: uid -> (offset, hash).
+# Chunks of an upload can be received by different processes; in such case the hash is not rebuilt on each chunk,
+# but calculated once during finalization, which costs one additional read of the file, but no additional write.
+_HASHES_MAX_SIZE = 256
+_hashes = _OrderedDict()  # type: _OrderedDict[str, _Tuple[int, object]]
+_hashes_lock = _Lock()
+
+
+class Upload:
+    """Upload Session
+    """
+
+    def __init__(self, uid: str, data: dict):
+        """Init
+        """
+        self._uid = uid
+        self._data = data
+
+    @property
+    def uid(self) -> str:
+        return self._uid
+
+    @property
+    def path(self) -> str:
+        return self._data['path']
+
+    @property
+    def storage_path(self) -> str:
+        return _os.path.join(_reg.get('paths.storage'), self._data['path'])
+
+    @property
+    def name(self) -> str:
+        return self._data['name']
+
+    @property
+    def mime(self) -> str:
+        return self._data['mime']
+
+    @property
+    def description(self) -> str:
+        return self._data['description']
+
+    @property
+    def length(self) -> int:
+        return self._data['length']
+
+    @property
+    def owner(self) -> str:
+        return self._data['owner']
+
+    @property
+    def is_complete(self) -> bool:
+        """Whether all data has been received and finalization has been started
+        """
+        return self._data.get('complete', False)
+
+    @property
+    def processed_path(self) -> _Optional[str]:
+        """Path to the file after processing, if processing has moved it
+        """
+        return self._data.get('processed_path')
+
+    @property
+    def file_uid(self) -> _Optional[str]:
+        """UID of the file created by finalization
+        """
+        return self._data.get('file_uid')
+
+    @property
+    def offset(self) -> int:
+        if self.is_complete or self.file_uid:
+            return self.length
+
+        try:
+            return _os.path.getsize(self.storage_path)
+        except FileNotFoundError:
+            return 0
+
+    def as_jsonable(self) -> dict:
+        return {
+            'uid': self.uid,
+            'name': self.name,
+            'mime': self.mime,
+            'description': self.description,
+            'length': self.length,
+            'offset': self.offset,
+        }
+
+
+def _get_sessions_dir() -> str:
+    return _os.path.join(_reg.get('paths.storage'), 'file_upload')
+
+
+def _get_session_path(uid: str) -> str:
+    if not _UID_RE.match(uid):
+        raise _error.UploadNotFound('Upload {} is not found'.format(uid))
+
+    return _os.path.join(_get_sessions_dir(), uid + '.json')
+
+
+def _get_owner_dir(owner: str) -> str:
+    """Get directory which indexes unfinished uploads of an owner
+    """
+    return _os.path.join(_get_sessions_dir(), 'owner', _hashlib.sha1(owner.encode()).hexdigest())
+
+
+@_contextmanager
+def _owner_lock(owner: str):
+    """Serialize creation of uploads of an owner
+    """
+    owner_dir = _get_owner_dir(owner)
+    if not _os.path.exists(owner_dir):
+        _os.makedirs(owner_dir, 0o755, True)
+
+    with open(_os.path.join(owner_dir, '.lock'), 'a') as f:
+        _flock(f.fileno(), _LOCK_EX)
+        yield owner_dir
+
+
+def _save_session(upload: Upload, **kwargs):
+    """Atomically update session data
+    """
+    upload._data.update(kwargs)
+
+    fd, tmp_path = _mkstemp('.tmp', '.', _get_sessions_dir())
+    try:
+        with open(fd, 'wt') as f:
+            _json.dump(upload._data, f)
+        _os.replace(tmp_path, _get_session_path(upload.uid))
+    except Exception:
+        if _os.path.exists(tmp_path):
+            _os.unlink(tmp_path)
+        raise
+
+
+def _unlink(path: str):
+    try:
+        _os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _pop_hash(uid: str, offset: int = None):
+    """Pop incremental hash of an upload, if it matches the offset
+    """
+    with _hashes_lock:
+        cached_offset, h = _hashes.pop(uid, (None, None))
+
+    if offset is not None and cached_offset != offset:
+        return None
+
+    return h
+
+
+def _put_hash(uid: str, offset: int, h):
+    with _hashes_lock:
+        _hashes[uid] = (offset, h)
+        _hashes.move_to_end(uid)
+        while len(_hashes) > _HASHES_MAX_SIZE:
+            _hashes.popitem(False)
+
+
+def _lock(f):
+    try:
+        _flock(f.fileno(), _LOCK_EX | _LOCK_NB)
+    except BlockingIOError:
+        raise _error.UploadLocked('Upload is being processed by another request')
+
+
+def _remove_owner_index(upload: Upload):
+    if upload.owner:
+        _unlink(_os.path.join(_get_owner_dir(upload.owner), upload.uid))
+
+
+def _remove_session(upload: Upload):
+    _pop_hash(upload.uid)
+    _remove_owner_index(upload)
+    _unlink(_get_session_path(upload.uid))
+
+
+def _is_path_used(path: str) -> bool:
+    """Check if a storage path is used by an entity
+    """
+    for model in ('file', 'file_image'):
+        if _odm.find(model).eq('path', path).count():
+            return True
+
+    return False
+
+
+def _remove_data(upload: Upload):
+    """Remove uploaded data, unless it is used by an entity
+    """
+    storage_dir = _reg.get('paths.storage')
+
+    # File of the upload could be already used by an entity, if the process has failed right after finalization
+    for path in (upload.path, upload.processed_path):
+        if path and not _is_path_used(path):
+            _unlink(_os.path.join(storage_dir, path))
+
+
+def _locate(upload: Upload) -> _Tuple[_Optional[str], str]:
+    """Get absolute path and MIME type of upload's data
+    """
+    if _os.path.exists(upload.storage_path):
+        return upload.storage_path, upload.mime
+
+    # Previous finalization attempt has moved the file, see finalize()
+    if upload.processed_path:
+        processed_path = _os.path.join(_reg.get('paths.storage'), upload.processed_path)
+        if _os.path.exists(processed_path):
+            return processed_path, upload._data['processed_mime']
+
+    return None, upload.mime
+
+
+def _validate_content(abs_path: str, mime: str):
+    """Check if the content of an upload corresponds to its MIME type
+    """
+    if not _driver._IMG_MIME_RE.search(mime):
+        return
+
+    from PIL import Image as _PILImage
+
+    try:
+        with _PILImage.open(abs_path):
+            pass
+    except (_PILImage.UnidentifiedImageError, _PILImage.DecompressionBombError, SyntaxError) as e:
+        raise _error.UploadInvalidFile('Content is not a valid {} image: {}'.format(mime, e))
+
+
+def create(name: str, mime: str, length: int, description: str = None, owner: str = None) -> Upload:
+    """Create an upload session
+    """
+    if not _MIME_RE.match(mime):
+        raise ValueError("Invalid MIME type: '{}'".format(mime))
+
+    if length < 0:
+        raise ValueError('Upload length cannot be negative')
+
+    max_length = _api.get_upload_max_length()
+    if max_length and length > max_length:
+        raise _error.UploadLengthExceeded('Upload length cannot exceed {} bytes'.format(max_length))
+
+    sessions_dir = _get_sessions_dir()
+    if not _os.path.exists(sessions_dir):
+        _os.makedirs(sessions_dir, 0o755, True)
+
+    if not owner:
+        return _create(name, mime.lower(), length, description, owner)
+
+    # Count only this owner's uploads, holding the lock until the new upload is indexed
+    with _owner_lock(owner) as owner_dir:
+        max_sessions = _api.get_upload_max_sessions()
+        if max_sessions and len([n for n in _os.listdir(owner_dir) if n != '.lock']) >= max_sessions:
+            raise _error.UploadLimitExceeded('Number of unfinished uploads cannot exceed {}'.format(max_sessions))
+
+        upload = _create(name, mime.lower(), length, description, owner)
+        open(_os.path.join(owner_dir, upload.uid), 'x').close()
+
+        return upload
+
+
+def _create(name: str, mime: str, length: int, description: str, owner: str) -> Upload:
+    # Reserve a file in the storage, so chunks are written directly to their final location
+    while True:
+        abs_path = _driver._build_store_path(name, mime)
+        target_dir = _os.path.dirname(abs_path)
+        if not _os.path.exists(target_dir):
+            _os.makedirs(target_dir, 0o755, True)
+
+        try:
+            open(abs_path, 'xb').close()
+            break
+        except FileExistsError:
+            continue
+
+    uid = _util.random_str(32)
+    data = {
+        'path': abs_path.replace(_reg.get('paths.storage') + '/', ''),
+        'name': name,
+        'mime': mime,
+        'description': description,
+        'length': length,
+        'owner': owner,
+        'created': _time(),
+    }
+
+    with open(_get_session_path(uid), 'xt') as f:
+        _json.dump(data, f)
+
+    return Upload(uid, data)
+
+
+def get(uid: str) -> Upload:
+    """Get an upload session
+    """
+    try:
+        with open(_get_session_path(uid), 'rt') as f:
+            return Upload(uid, _json.load(f))
+    except FileNotFoundError:
+        raise _error.UploadNotFound('Upload {} is not found'.format(uid))
+
+
+def write(uid: str, offset: int, stream, chunk_size: int = 1048576) -> int:
+    """Append data from a stream to an upload, starting at the offset
+
+    Returns new offset of the upload.
+    """
+    upload = get(uid)
+    if upload.is_complete or upload.file_uid:
+        raise _error.UploadFinalized('Upload {} is already finalized'.format(uid))
+
+    try:
+        f = open(upload.storage_path, 'r+b')
+    except FileNotFoundError:
+        raise _error.UploadNotFound('Upload {} is not found'.format(uid))
+
+    with f:
+        _lock(f)
+
+        # Session may have been finalized between get() and taking the lock
+        upload = get(uid)
+        if upload.is_complete or upload.file_uid:
+            raise _error.UploadFinalized('Upload {} is already finalized'.format(uid))
+
+        current_offset = _os.fstat(f.fileno()).st_size
+        if offset != current_offset:
+            raise _error.UploadOffsetMismatch('Expected offset {}, got {}'.format(current_offset, offset))
+
+        # Hash is continued only if previous chunk was written by this process, otherwise it's calculated on finalization
+        h = _pop_hash(uid, current_offset)
+        if h is None and current_offset == 0:
+            h = _hashlib.sha256()
+
+        f.seek(current_offset)
+        remaining = upload.length - current_offset
+
+        while True:
+            # Read one byte more than allowed to detect data beyond declared length
+            chunk = stream.read(min(chunk_size, remaining + 1))
+            if not chunk:
+                break
+            if len(chunk) > remaining:
+                raise _error.UploadLengthExceeded('Upload length {} exceeded'.format(upload.length))
+
+            f.write(chunk)
+            if h is not None:
+                h.update(chunk)
+            remaining -= len(chunk)
+
+        f.flush()
+
+        new_offset = upload.length - remaining
+        if h is not None:
+            _put_hash(uid, new_offset, h)
+
+        return new_offset
+
+
+def finalize(uid: str) -> _file.model.AbstractFile:
+    """Finalize an upload and create a file from it
+
+    Finalization is idempotent: repeated calls return the same file. If it fails after processing of the file has been
+    started, e.g. because of a database failure, next call continues with the processed file.
+    """
+    upload = get(uid)
+    if upload.file_uid:
+        return _file.get(upload.file_uid)
+
+    abs_path, mime = _locate(upload)
+    try:
+        f = open(abs_path, 'rb') if abs_path else None
+    except FileNotFoundError:
+        f = None
+
+    if not f:
+        # File could be moved by processing during concurrent finalization
+        upload = get(uid)
+        if upload.file_uid:
+            return _file.get(upload.file_uid)
+        raise _error.UploadNotFound('Upload {} is not found'.format(uid))
+
+    with f:
+        _lock(f)
+
+        # Session may have been finalized between get() and taking the lock
+        upload = get(uid)
+        if upload.file_uid:
+            return _file.get(upload.file_uid)
+
+        if not upload.is_complete:
+            offset = _os.fstat(f.fileno()).st_size
+            if offset != upload.length:
+                raise _error.UploadIncomplete('Upload {} is incomplete: {} of {} bytes received'.format(
+                    uid, offset, upload.length))
+
+            try:
+                _validate_content(abs_path, mime)
+            except _error.UploadInvalidFile:
+                _remove_data(upload)
+                _remove_session(upload)
+                raise
+
+            h = _pop_hash(uid, offset)
+            file_hash = h.hexdigest() if h is not None else _api.hash_file(abs_path)
+
+            # From now on the file can be changed by processing, so its length is not checked anymore
+            _save_session(upload, complete=True)
+
+        else:
+            # Previous attempt has failed, file could be changed by processing, so its hash is calculated by the entity
+            file_hash = None
+
+            # Processed file is partial, if processing has failed before removing the original one
+            if abs_path == upload.storage_path and upload.processed_path and upload.processed_path != upload.path:
+                _unlink(_os.path.join(_reg.get('paths.storage'), upload.processed_path))
+
+        odm_entity = _driver._dispense_entity(abs_path, mime, upload.name, upload.description, file_hash)
+        try:
+            odm_entity.save()
+        except Exception:
+            # Processing could move the file before the failure, remember its location for the next attempt
+            processed_path = odm_entity.f_get('path')
+            if processed_path != upload.path:
+                _save_session(upload, processed_path=processed_path, processed_mime=odm_entity.f_get('mime'))
+            raise
+
+        r = _driver._wrap_entity(odm_entity)
+
+        # Remember created file while still holding the lock, so concurrent and repeated calls get the same file
+        _save_session(upload, file_uid=r.uid)
+        _remove_owner_index(upload)
+
+    return r
+
+
+def abort(uid: str):
+    """Abort an upload and remove its data
+    """
+    upload = get(uid)
+
+    if not upload.file_uid:
+        _remove_data(upload)
+
+    _remove_session(upload)
+
+
+def get_uids() -> _List[str]:
+    """Get UIDs of all existing upload sessions
+    """
+    sessions_dir = _get_sessions_dir()
+    if not _os.path.isdir(sessions_dir):
+        return []
+
+    return [_os.path.splitext(n)[0] for n in _os.listdir(sessions_dir) if n.endswith('.json')]
+
+
+def get_pending_paths() -> _Set[str]:
+    """Get storage paths of files which are being uploaded
+    """
+    r = set()
+
+    for uid in get_uids():
+        try:
+            upload = get(uid)
+            if not upload.file_uid:
+                r.add(upload.path)
+                if upload.processed_path:
+                    r.add(upload.processed_path)
+        except _error.UploadNotFound:
+            pass
+
+    return r
+
+
+def cleanup(ttl: int) -> _List[str]:
+    """Abort uploads which were not updated during TTL seconds
+
+    Sessions of finalized uploads are also removed after TTL, they are kept only to make finalization retriable.
+    """
+    r = []
+    now = _time()
+
+    for uid in get_uids():
+        try:
+            upload = get(uid)
+            abs_path = _locate(upload)[0]
+            mtime = _os.path.getmtime(abs_path) if abs_path else 0
+            if now - max(mtime, _os.path.getmtime(_get_session_path(uid))) > ttl:
+                abort(uid)
+                r.append(uid)
+        except _error.UploadNotFound:
+            pass
+
+    # Remove index entries left by failed processes
+    owners_dir = _os.path.join(_get_sessions_dir(), 'owner')
+    if _os.path.isdir(owners_dir):
+        for owner_dir in _os.listdir(owners_dir):
+            owner_dir = _os.path.join(owners_dir, owner_dir)
+            for uid in _os.listdir(owner_dir):
+                if _UID_RE.match(uid) and not _os.path.exists(_get_session_path(uid)):
+                    _unlink(_os.path.join(owner_dir, uid))
+
+    return r
@@ -0,0 +1,51 @@
+"""PytSite ODM File Storage Startup Time Benchmark
+
+Run from the root directory of a PytSite application:
+
+    python plugins/file_storage_odm/benchmark/startup.py [runs]
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import sys
+import subprocess
+from statistics import mean, median
+
+_HEAVY_MODULES = ('PIL.Image', 'exifread')
+
+# PytSite loads installed plugins during its bootstrap, so the bootstrap is measured as a whole
+_PROBE = """
+import sys, time
+t = time.perf_counter()
+import pytsite, {module}
+print(time.perf_counter() - t)
+print(','.join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+
+def _measure(module: str, runs: int):
+    """Bootstrap PytSite and import module in a number of fresh interpreters and measure time
+    """
+    timings = []
+    loaded = ''
+
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, '-c', _PROBE.format(module=module, heavy=_HEAVY_MODULES)],
+                                      universal_newlines=True).splitlines()
+        timings.append(float(out[0]) * 1000)
+        loaded = out[1] if len(out) > 1 else ''
+
+    return timings, loaded
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    timings, loaded = _measure('plugins.file_storage_odm', runs)
+    print('Startup: mean {:.1f} ms, median {:.1f} ms, min {:.1f} ms, heavy modules loaded: {}'.format(
+        mean(timings), median(timings), min(timings), loaded or 'none'))
+
+
+if __name__ == '__main__':
+    main()
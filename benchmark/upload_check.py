@@ -0,0 +1,288 @@
+"""PytSite ODM File Storage Resumable Uploads Check
+
+Exercises filesystem part of resumable uploads: creation, writing, finalization, abortion and cleanup. Entities are not
+stored in the database, ODM part of the driver is replaced by an in-memory stub.
+
+Run from the root directory of a PytSite application:
+
+    python plugins/file_storage_odm/benchmark/upload_check.py
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import sys
+import os
+import io
+import time
+import hashlib
+import tempfile
+import threading
+from pytsite import reg
+from plugins.file_storage_odm import _driver, _upload, _error
+
+_files = {}
+_failures = []
+
+
+class _Entity:
+    """In-memory replacement of an ODM entity
+    """
+
+    # Callable which is invoked by save() with the entity, to simulate processing or failures
+    on_save = None
+
+    def __init__(self, abs_path: str, mime: str, name: str, description: str = None, file_hash: str = None):
+        self._fields = {
+            'path': os.path.relpath(abs_path, reg.get('paths.storage')),
+            'name': name,
+            'description': description,
+            'mime': mime,
+            'length': os.path.getsize(abs_path),
+            'hash': file_hash,
+        }
+
+    def f_get(self, name: str):
+        return self._fields[name]
+
+    def f_set(self, name: str, value):
+        self._fields[name] = value
+
+    def save(self):
+        if _Entity.on_save:
+            _Entity.on_save(self)
+
+        # Same as AnyFileODMEntity does for entities without hash
+        abs_path = os.path.join(reg.get('paths.storage'), self._fields['path'])
+        if not self._fields['hash']:
+            self._fields['hash'] = _sha256(open(abs_path, 'rb').read())
+        self._fields['length'] = os.path.getsize(abs_path)
+
+
+class _File:
+    """In-memory replacement of a file model
+    """
+
+    def __init__(self, entity: _Entity):
+        self.uid = 'file:{}'.format(len(_files))
+        self.entity = entity
+        _files[self.uid] = self
+
+
+def _get_file(uid: str) -> _File:
+    return _files[uid]
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _check(title: str, condition: bool):
+    print('{} {}'.format('PASS' if condition else 'FAIL', title))
+    if not condition:
+        _failures.append(title)
+
+
+def _raises(exc_type: type, func, *args) -> bool:
+    try:
+        func(*args)
+    except exc_type:
+        return True
+    except Exception as e:
+        print('     unexpected {}: {}'.format(type(e).__name__, e))
+        return False
+
+    return False
+
+
+def _succeeds(func, *args) -> bool:
+    try:
+        func(*args)
+    except Exception as e:
+        print('     unexpected {}: {}'.format(type(e).__name__, e))
+        return False
+
+    return True
+
+
+def _write(uid: str, offset: int, data: bytes) -> int:
+    return _upload.write(uid, offset, io.BytesIO(data), 4)
+
+
+def check_write():
+    data = os.urandom(100)
+    u = _upload.create('data.bin', 'application/octet-stream', len(data), None, 'owner-1')
+
+    _check('write: first chunk', _write(u.uid, 0, data[:30]) == 30)
+    _check('write: offset mismatch', _raises(_error.UploadOffsetMismatch, _write, u.uid, 10, data[10:30]))
+    _check('write: offset is kept', _upload.get(u.uid).offset == 30)
+    _check('write: second chunk', _write(u.uid, 30, data[30:60]) == 60)
+
+    # Chunks received by another process don't have the incremental hash in this process
+    _upload._hashes.clear()
+    _check('write: chunk after foreign process', _write(u.uid, 60, data[60:]) == 100)
+    _check('write: data beyond length', _raises(_error.UploadLengthExceeded, _write, u.uid, 100, b'x'))
+
+    f = _upload.finalize(u.uid)
+    _check('finalize: hash of foreign process upload', f.entity.f_get('hash') == _sha256(data))
+    _check('finalize: stored data', open(_upload.get(u.uid).storage_path, 'rb').read() == data)
+    _check('finalize: repeated call returns the same file', _upload.finalize(u.uid) is f)
+    _check('finalize: write after finalization', _raises(_error.UploadFinalized, _write, u.uid, 100, b''))
+    _check('finalize: offset of finalized upload', _upload.get(u.uid).offset == 100)
+
+    # Incremental hash of this process
+    u = _upload.create('data.bin', 'application/octet-stream', len(data), None, 'owner-1')
+    _write(u.uid, 0, data)
+    _check('finalize: incremental hash', _upload.finalize(u.uid).entity.f_get('hash') == _sha256(data))
+
+    _check('create: invalid MIME', _raises(ValueError, _upload.create, 'a', '../../etc', 1, None, 'owner-1'))
+    _check('create: max length', _raises(_error.UploadLengthExceeded, _upload.create, 'a', 'text/plain',
+                                         _upload._api.get_upload_max_length() + 1, None, 'owner-1'))
+
+    u = _upload.create('data.bin', 'application/octet-stream', len(data), None, 'owner-1')
+    _write(u.uid, 0, data[:50])
+    _check('finalize: incomplete upload', _raises(_error.UploadIncomplete, _upload.finalize, u.uid))
+    _upload.abort(u.uid)
+    _check('abort: data removed', not os.path.exists(u.storage_path))
+    _check('abort: session removed', _raises(_error.UploadNotFound, _upload.get, u.uid))
+
+
+def check_concurrent_finalize():
+    data = os.urandom(100)
+    u = _upload.create('data.bin', 'application/octet-stream', len(data), None, 'owner-2')
+    _write(u.uid, 0, data)
+
+    results = []
+    _Entity.on_save = lambda e: time.sleep(0.2)
+
+    def finalize():
+        try:
+            results.append(_upload.finalize(u.uid))
+        except _error.UploadLocked as e:
+            results.append(e)
+
+    files_before = len(_files)
+    threads = [threading.Thread(target=finalize) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    _Entity.on_save = None
+
+    created = [r for r in results if isinstance(r, _File)]
+    _check('concurrent finalize: one file created', len(_files) - files_before == 1)
+    _check('concurrent finalize: others locked or got the same file',
+           all(r is created[0] or isinstance(r, _error.UploadLocked) for r in results))
+    _check('concurrent finalize: write rejected', _raises(_error.UploadFinalized, _write, u.uid, 100, b''))
+
+
+def check_retry():
+    data = os.urandom(100)
+    u = _upload.create('image.bin', 'application/octet-stream', len(data), None, 'owner-3')
+    _write(u.uid, 0, data)
+    storage_dir = reg.get('paths.storage')
+
+    # Simulate conversion, which stores the file under another path and removes the original one, then fails
+    def convert_and_fail(entity: _Entity):
+        _Entity.on_save = None
+        src = os.path.join(storage_dir, entity.f_get('path'))
+        converted = src + '.converted'
+        with open(converted, 'wb') as f:
+            f.write(b'converted' + data)
+        os.unlink(src)
+        entity.f_set('path', os.path.relpath(converted, storage_dir))
+        entity.f_set('mime', 'application/x-converted')
+        raise RuntimeError('Database failure')
+
+    _Entity.on_save = convert_and_fail
+    _check('retry: failure is propagated', _raises(RuntimeError, _upload.finalize, u.uid))
+    _check('retry: session kept', _upload.get(u.uid).processed_path == u.path + '.converted')
+    _check('retry: processed file is pending', u.path + '.converted' in _upload.get_pending_paths())
+
+    f = _upload.finalize(u.uid)
+    _check('retry: file created from processed file', f.entity.f_get('path') == u.path + '.converted')
+    _check('retry: processed MIME', f.entity.f_get('mime') == 'application/x-converted')
+    _check('retry: hash of processed file', f.entity.f_get('hash') == _sha256(b'converted' + data))
+    _check('retry: length of processed file', f.entity.f_get('length') == len(data) + 9)
+
+    # Failure without processing keeps the session and the data
+    u = _upload.create('data.bin', 'application/octet-stream', len(data), None, 'owner-3')
+    _write(u.uid, 0, data)
+    _Entity.on_save = lambda e: (_ for _ in ()).throw(RuntimeError('Database failure'))
+    _raises(RuntimeError, _upload.finalize, u.uid)
+    _Entity.on_save = None
+    _check('retry: unprocessed data kept', os.path.exists(u.storage_path))
+    _check('retry: unprocessed file created', _upload.finalize(u.uid).entity.f_get('hash') == _sha256(data))
+
+
+def check_invalid_image():
+    data = b'not an image'
+    u = _upload.create('image.png', 'image/png', len(data), None, 'owner-4')
+    _write(u.uid, 0, data)
+
+    _check('invalid image: rejected', _raises(_error.UploadInvalidFile, _upload.finalize, u.uid))
+    _check('invalid image: data removed', not os.path.exists(u.storage_path))
+    _check('invalid image: session removed', _raises(_error.UploadNotFound, _upload.get, u.uid))
+
+
+def check_limit():
+    max_sessions = _upload._api.get_upload_max_sessions()
+    uploads = [_upload.create('a.txt', 'text/plain', 1, None, 'owner-5') for _ in range(max_sessions)]
+
+    _check('limit: exceeded', _raises(_error.UploadLimitExceeded, _upload.create, 'a.txt', 'text/plain', 1, None,
+                                      'owner-5'))
+    _check('limit: other owners are not affected', _succeeds(_upload.create, 'a.txt', 'text/plain', 1, None,
+                                                             'owner-6'))
+
+    _write(uploads[0].uid, 0, b'a')
+    _upload.finalize(uploads[0].uid)
+    _upload.abort(uploads[1].uid)
+    _upload.create('a.txt', 'text/plain', 1, None, 'owner-5')
+    _check('limit: finalized and aborted uploads are not counted', _succeeds(_upload.create, 'a.txt', 'text/plain',
+                                                                             1, None, 'owner-5'))
+
+
+def check_cleanup():
+    old = _upload.create('a.txt', 'text/plain', 1, None, 'owner-7')
+    fresh = _upload.create('a.txt', 'text/plain', 1, None, 'owner-7')
+
+    past = time.time() - 3600
+    os.utime(old.storage_path, (past, past))
+    os.utime(_upload._get_session_path(old.uid), (past, past))
+
+    # Index entry left by a failed process
+    stale = os.path.join(_upload._get_owner_dir('owner-7'), 'x' * 32)
+    open(stale, 'x').close()
+
+    _check('cleanup: stale upload removed', _upload.cleanup(60) == [old.uid])
+    _check('cleanup: stale data removed', not os.path.exists(old.storage_path))
+    _check('cleanup: fresh upload kept', _upload.get(fresh.uid).offset == 0)
+    _check('cleanup: stale index entry removed', not os.path.exists(stale))
+
+
+def main():
+    with tempfile.TemporaryDirectory() as storage_dir:
+        reg.put('paths.storage', storage_dir)
+        reg.put('file_storage_odm.upload_max_sessions', 3)
+        reg.put('file_storage_odm.upload_max_length', 1048576)
+        _upload._api.get_upload_max_sessions.cache_clear()
+        _upload._api.get_upload_max_length.cache_clear()
+
+        _driver._dispense_entity = _Entity
+        _driver._wrap_entity = _File
+        _upload._is_path_used = lambda path: any(f.entity.f_get('path') == path for f in _files.values())
+        _upload._file.get = _get_file
+
+        check_write()
+        check_concurrent_finalize()
+        check_retry()
+        check_invalid_image()
+        check_limit()
+        check_cleanup()
+
+    print('{} checks failed'.format(len(_failures)) if _failures else 'All checks passed')
+    sys.exit(1 if _failures else 0)
+
+
+if __name__ == '__main__':
+    main()